@@ -1,155 +1,493 @@
-import httpx
 import re
 import random
 import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
 from astrbot.api.event import filter, AstrMessageEvent
 from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 from astrbot.api.message_components import Image, Plain
 
+def _dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def _loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _fail_pending(futures):
+    """让尚未完成的审核 future 以异常结束，避免等待方永久挂起"""
+    for future in futures:
+        if not future.done():
+            future.set_exception(RuntimeError("ImageGuard audit cancelled"))
+
+_VERDICT_TTL = 4 * 3600      # 判定缓存有效期（秒）
+_VERDICT_CACHE_SIZE = 10000   # 判定缓存最大条目数
+_BURST_WINDOW = 10            # 同一用户连发图片时沿用违规判定的窗口（秒）
+_MAX_IMAGES = 4               # 单次 LLM 调用的最大图片数
+_BATCH_SIZE = 4               # 单次合并审核的最大消息数
+_BATCH_WAIT = 0.15            # 合并窗口（秒）
+
+# 兜底检测用，避免对整段回复做 upper() 复制
+_VIOLATION_RE = re.compile(r"VIOLATION", re.IGNORECASE)
+
+_SINGLE_FORMAT = (
+    "【输出格式要求】\n"
+    "请严格按照以下两行格式输出，不要包含其他废话：\n"
+    "REASON: [这里简要说明判断理由，不超过20字]\n"
+    "RESULT: [SAFE 或 VIOLATION]\n"
+)
+
+def _batch_format(groups):
+    """多组图片合并审核时的输出格式要求，groups 为每组图片数量"""
+    lines = []
+    start = 1
+    for i, count in enumerate(groups, 1):
+        end = start + count - 1
+        span = f"第 {start} 张" if count == 1 else f"第 {start}~{end} 张"
+        lines.append(f"第 {i} 组：{span}图片\n")
+        start = end + 1
+    return (
+        f"【图片分组】\n共 {len(groups)} 组图片，按发送顺序排列：\n"
+        + "".join(lines) + "\n"
+        "【输出格式要求】\n"
+        "请对每一组分别判断，严格按照以下格式逐组输出（i 为组号），不要包含其他废话：\n"
+        "REASON_i: [这里简要说明判断理由，不超过20字]\n"
+        "RESULT_i: [SAFE 或 VIOLATION]\n"
+    )
+
+def _parse_batch_verdict(response_text: str, count: int):
+    """解析合并审核的输出，返回按组号排列的 (是否违规, 理由, True) 列表，缺失的组为 None"""
+    results = [None] * count
+    reasons = [""] * count
+
+    for line in response_text.splitlines():
+        s = line.lstrip()
+        u = s[:7].upper()
+        if u != "RESULT_" and u != "REASON_": continue
+        colon = s.find(":", 7)
+        if colon < 0: continue
+        try:
+            idx = int(s[7:colon]) - 1
+        except ValueError:
+            continue
+        if not 0 <= idx < count: continue
+        if u == "RESULT_":
+            if results[idx] is None:
+                results[idx] = "VIOLATION" in s[colon + 1:].upper()
+        elif not reasons[idx]:
+            reasons[idx] = s[colon + 1:].strip()
+
+    return [
+        None if r is None else (r, reasons[i] or "未说明理由", True)
+        for i, r in enumerate(results)
+    ]
+
+def _parse_verdict(response_text: str):
+    """逐行扫描 LLM 输出，解析 RESULT/REASON，返回 (是否违规, 理由, 是否解析到 RESULT 行)"""
+    result_found = False
+    is_violation = False
+    reason_str = ""
+
+    for line in response_text.splitlines():
+        s = line.lstrip()
+        if not s: continue
+        u = s[:7].upper()
+        if u == "RESULT:":
+            if not result_found:
+                result_found = True
+                is_violation = "VIOLATION" in s[7:].upper()
+        elif u == "REASON:":
+            if not reason_str:
+                reason_str = s[7:].strip()
+
+    # 兜底检测
+    if not result_found and _VIOLATION_RE.search(response_text):
+        is_violation = True
+
+    if not reason_str:
+        reason_str = response_text.split('\n')[0][:50] if is_violation else "未说明理由"
+    return is_violation, reason_str, result_found
+
 @register("image_guard", "YEZI", "图片内容审查卫士", "1.6.6") # 版本号升级
 class ImageGuard(Star):
     def __init__(self, context: Context, config: dict):
         super().__init__(context)
         self.config = config
+        self._http = None
+        self._stream_unsupported = False
+        # 配置派生值缓存，仅在配置对象或版本号变化时重新计算
+        self._cfg_version = None
+        self._cached = {}
+        self._group_scope = frozenset()
+        self._private_scope = frozenset()
+        # 图片判定缓存: key -> (是否违规, 理由, 写入时间)，按 LRU 淘汰
+        self._verdict_cache = OrderedDict()
+        # 合并审核队列: (prompt, image_urls, future)
+        self._queue = asyncio.Queue()
+        self._batch_task = None
+        self._batch_jobs = set()
+        # 用户最近一次审核: (group_id, user_id) -> (开始时间, 判定 future)
+        self._recent = {}
+
+    def _client(self):
+        """复用同一个 httpx 客户端，避免每次审核都重新建连"""
+        if self._http is None or self._http.is_closed:
+            # 仅在配置了独立 LLM 时才需要 httpx，延迟导入以减少插件加载开销
+            import httpx
+            self._http = httpx.AsyncClient(
+                timeout=30,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+            )
+        return self._http
+
+    def _refresh_cache(self):
+        """预处理配置：范围集合、审核提示词等只在配置变化时重新生成"""
+        version = (id(self.config), self.config.get("_version"))
+        if version == self._cfg_version: return
+
+        forbidden_texts = self.config.get("sensitive_texts", [])
+        forbidden_descs = self.config.get("forbidden_descriptions", [])
+        custom_instruction = self.config.get("custom_vision_prompt", "")
+        prompt = (
+            "你是一个严格但公正的内容审核员。请分析图片是否包含违规信息。\n"
+            f"【自定义关注点】\n{custom_instruction}\n\n"
+            "【违规标准】\n"
+            f"1. 包含文字：{str(forbidden_texts)}\n"
+            f"2. 包含画面：{str(forbidden_descs)}\n\n"
+        )
+
+        self._cached = {
+            "check_probability": self.config.get("check_probability", 1.0),
+            "has_rules": bool(forbidden_texts or forbidden_descs),
+            "prompt": prompt,
+            "llm_api_key": self.config.get("llm_api_key"),
+            "llm_base_url": self.config.get("llm_base_url"),
+            "llm_model": self.config.get("llm_model"),
+            "ban_duration": int(self.config.get("ban_duration", 86400)),
+            "enable_recall": self.config.get("enable_recall", True),
+            "report_target_id": self.config.get("report_target_id"),
+        }
+        self._group_scope = frozenset(str(x) for x in self.config.get("group_scope", ["0"]))
+        self._private_scope = frozenset(str(x) for x in self.config.get("private_scope", []))
+        self._cfg_version = version
+
+    def _verdict_key(self, prompt, url):
+        model = self._cached["llm_model"] or "default"
+        return hashlib.sha256(f"{model}|{prompt}|{url}".encode()).hexdigest()
+
+    def _get_cached_verdict(self, prompt, image_urls):
+        """所有图片都命中缓存时返回 (是否违规, 理由, 违规图片)，否则返回 None"""
+        now = time.monotonic()
+        hit = None
+        for url in image_urls:
+            key = self._verdict_key(prompt, url)
+            entry = self._verdict_cache.get(key)
+            if entry is None or now - entry[2] > _VERDICT_TTL:
+                self._verdict_cache.pop(key, None)
+                return None
+            self._verdict_cache.move_to_end(key)
+            if entry[0] and hit is None:
+                hit = (True, entry[1], url)
+        return hit or (False, "", image_urls[0])
+
+    def _put_cached_verdict(self, prompt, url, is_violation, reason):
+        key = self._verdict_key(prompt, url)
+        self._verdict_cache[key] = (is_violation, reason, time.monotonic())
+        self._verdict_cache.move_to_end(key)
+        while len(self._verdict_cache) > _VERDICT_CACHE_SIZE:
+            self._verdict_cache.popitem(last=False)
+
+    async def _audit(self, prompt, image_urls):
+        """提交审核请求，由后台任务在短时间窗口内合并后统一调用 LLM"""
+        if self._batch_task is None or self._batch_task.done():
+            self._batch_task = asyncio.create_task(self._batch_worker())
+
+        # 图片过多时拆分提交，保证每张图都被审核
+        # 返回 (是否违规, 理由, 是否解析到 RESULT, 违规图片)，违规图片取所在分块的第一张
+        loop = asyncio.get_running_loop()
+        futures = []
+        chunk_urls = []
+        for i in range(0, len(image_urls), _MAX_IMAGES):
+            future = loop.create_future()
+            await self._queue.put((prompt, image_urls[i:i + _MAX_IMAGES], future))
+            futures.append(future)
+            chunk_urls.append(image_urls[i])
+        if len(futures) == 1:
+            return await futures[0] + (image_urls[0],)
+
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        verdicts = [
+            r + (url,) for r, url in zip(results, chunk_urls)
+            if not isinstance(r, BaseException)
+        ]
+        # 任一分块判定违规即可；仅当所有分块都失败时才抛出异常
+        violation = next((v for v in verdicts if v[0]), None)
+        if violation: return violation
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if not verdicts: raise errors[0]
+        for e in errors:
+            logger.warning("[ImageGuard] Partial check failed: %s", e)
+        # 有分块失败或未解析到 RESULT 时，安全判定不可靠
+        parsed = not errors and all(v[2] for v in verdicts)
+        return False, verdicts[0][1], parsed, image_urls[0]
+
+    async def _audit_burst(self, sender, prompt, image_urls):
+        """同一用户短时间内连发图片时，若其上一次审核已判定违规则直接沿用，
+        返回 (是否违规, 理由, 违规图片, 是否可缓存)"""
+        now = time.monotonic()
+        for key in [k for k, (t, _) in self._recent.items() if now - t > _BURST_WINDOW]:
+            del self._recent[key]
+
+        # 只看已完成的审核，进行中的不等待，以免连发的正常图片多等一轮 LLM
+        entry = self._recent.get(sender)
+        if entry is not None and entry[1].done():
+            verdict = entry[1].result()
+            # 只沿用违规判定，否则刷屏者可借一张正常图片放行后续图片
+            if verdict and verdict[0]:
+                return verdict[0], verdict[1], verdict[2], False
+
+        # 上一次审核仍在进行时保留它的记录，以便其违规结果可被后续消息沿用
+        future = None
+        if entry is None or entry[1].done():
+            future = asyncio.get_running_loop().create_future()
+            self._recent[sender] = (now, future)
+        try:
+            is_violation, reason_str, parsed, violation_url = await self._audit(prompt, image_urls)
+        except BaseException:
+            if future is not None: future.set_result(None)
+            raise
+        # 记录原始违规图片，沿用判定时作为证据上报
+        verdict = (is_violation, reason_str, violation_url)
+        if future is not None: future.set_result(verdict)
+        # 沿用的判定与未解析到 RESULT 的判定都不缓存
+        return verdict + (parsed,)
+
+    async def _batch_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + _BATCH_WAIT
+            try:
+                while len(batch) < _BATCH_SIZE:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0: break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                _fail_pending(future for _, _, future in batch)
+                raise
+
+            # 规则相同且图片总数不超过上限的请求才能合并
+            groups = {}
+            for item in batch:
+                chunks = groups.setdefault(item[0], [[]])
+                if sum(len(urls) for _, urls, _ in chunks[-1]) + len(item[1]) > _MAX_IMAGES:
+                    chunks.append([])
+                chunks[-1].append(item)
+            for prompt, chunks in groups.items():
+                for items in chunks:
+                    if not items: continue
+                    job = asyncio.create_task(self._run_batch(prompt, items))
+                    self._batch_jobs.add(job)
+                    job.add_done_callback(self._batch_jobs.discard)
+
+    async def _run_batch(self, prompt, items):
+        verdicts = [None] * len(items)
+        try:
+            if len(items) > 1:
+                image_urls = [url for _, urls, _ in items for url in urls]
+                response_text = await self._call_audit_llm(
+                    prompt + _batch_format([len(urls) for _, urls, _ in items]),
+                    image_urls,
+                    max_tokens=100 * len(items)
+                )
+                verdicts = _parse_batch_verdict(response_text, len(items))
+        except Exception as e:
+            logger.warning("[ImageGuard] Batch check failed, fallback to single: %s", e)
+
+        # 单条请求或合并结果缺失的组，逐条并发审核
+        async def audit_single(image_urls, future, verdict):
+            if future.done(): return
+            try:
+                if verdict is None:
+                    response_text = await self._call_audit_llm(prompt + _SINGLE_FORMAT, image_urls)
+                    verdict = _parse_verdict(response_text)
+                # 等待方可能已被取消，此时 future 已结束
+                if not future.done(): future.set_result(verdict)
+            except Exception as e:
+                if not future.done(): future.set_exception(e)
+
+        try:
+            await asyncio.gather(*(
+                audit_single(image_urls, future, verdict)
+                for (_, image_urls, future), verdict in zip(items, verdicts)
+            ), return_exceptions=True)
+        finally:
+            # 任务被取消时，保证等待中的消息不会永远挂起
+            _fail_pending(future for _, _, future in items)
+
+    async def terminate(self):
+        """插件卸载时停止合并审核任务、释放等待中的请求并关闭 httpx 客户端"""
+        tasks = list(self._batch_jobs)
+        if self._batch_task is not None:
+            tasks.append(self._batch_task)
+            self._batch_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._batch_jobs.clear()
+
+        while not self._queue.empty():
+            _fail_pending([self._queue.get_nowait()[2]])
+
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
 
     @filter.event_message_type(filter.EventMessageType.ALL)
     async def on_image_message(self, event: AstrMessageEvent):
+        # 纯文本消息直接放行，不做任何后续处理
+        message_obj = event.message_obj
+        if not any(isinstance(c, Image) for c in message_obj.message or ()): return
+
         # === 1. 范围控制逻辑 ===
         group_id = event.get_group_id() or ""
         user_id = event.get_sender_id() or ""
         is_group = bool(group_id)
 
-        group_scope = [str(x) for x in self.config.get("group_scope", ["0"])]
-        private_scope = [str(x) for x in self.config.get("private_scope", [])]
+        self._refresh_cache()
+        cfg = self._cached
 
-        if is_group:
-            if "0" not in group_scope and group_id not in group_scope: return
-        else:
-            if "0" not in private_scope and user_id not in private_scope: return
+        scope = self._group_scope if is_group else self._private_scope
+        if "0" not in scope and (group_id if is_group else user_id) not in scope: return
 
-        # === 2. 表情包与GIF强过滤 (Sticker Filter) ===
-        raw_chain = []
-        try:
-            if hasattr(event, "original_event") and hasattr(event.original_event, "message"):
-                raw_chain = event.original_event.message
-            elif hasattr(event.message_obj, "raw_message"):
-                raw_chain = event.message_obj.raw_message
-            
-            if isinstance(raw_chain, list):
-                for seg in raw_chain:
-                    if isinstance(seg, dict) and seg.get("type") == "image":
-                        data = seg.get("data", {})
-                        sub_type = int(data.get("sub_type", 0))
-                        if sub_type != 0: return # 忽略表情包
-        except Exception:
-            pass 
-
-        # === 3. 提取图片 URL 并过滤 GIF ===
-        message_obj = event.message_obj
-        if not message_obj.message: return
-            
+        # === 2. 概率抽查 (未抽中的消息跳过后续处理) ===
+        cp = cfg["check_probability"]
+        if cp < 1.0 and random.random() > cp: return
+
+        # === 3. 表情包与GIF强过滤 (Sticker Filter) ===
+        raw_chain = (
+            getattr(getattr(event, "original_event", None), "message", None)
+            or getattr(message_obj, "raw_message", None)
+            or ()
+        )
+        if isinstance(raw_chain, list):
+            for seg in raw_chain:
+                if not isinstance(seg, dict) or seg.get("type") != "image": continue
+                data = seg.get("data")
+                if not isinstance(data, dict): continue
+                sub_type = data.get("sub_type", 0)
+                if type(sub_type) is not int:
+                    try:
+                        sub_type = int(sub_type)
+                    except (TypeError, ValueError):
+                        continue
+                if sub_type != 0: return # 忽略表情包
+
+        # === 4. 提取图片 URL 并过滤 GIF ===
+        seen = set()
         image_urls = []
         for component in message_obj.message:
             if isinstance(component, Image):
-                if component.url:
-                    clean_url = component.url.split('?')[0].lower()
-                    if clean_url.endswith('.gif'):
+                url = component.url
+                if url and url not in seen:
+                    # 只比较 ? 之前路径的最后 4 个字符，避免复制整个 URL
+                    q = url.find('?')
+                    end = len(url) if q < 0 else q
+                    if url[end - 4:end].lower() == '.gif':
                         continue
-                    image_urls.append(component.url)
+                    seen.add(url)
+                    image_urls.append(url)
         
         if not image_urls: return
 
-        # === 4. 概率抽查 ===
-        if random.random() > self.config.get("check_probability", 1.0): return
-
         # === 5. 检查配置 ===
-        forbidden_texts = self.config.get("sensitive_texts", [])
-        forbidden_descs = self.config.get("forbidden_descriptions", [])
-        
-        if not forbidden_texts and not forbidden_descs: return
+        if not cfg["has_rules"]: return
+
+        # 判罚依赖 OneBot 客户端，无法执法时不必调用 LLM
+        client = getattr(event, "bot", None) or getattr(event, "client", None)
+        if getattr(getattr(client, "api", None), "call_action", None) is None: return
 
         # === 6. 审核逻辑 ===
-        custom_instruction = self.config.get("custom_vision_prompt", "")
-        prompt = (
-            "你是一个严格但公正的内容审核员。请分析图片是否包含违规信息。\n"
-            f"【自定义关注点】\n{custom_instruction}\n\n"
-            "【违规标准】\n"
-            f"1. 包含文字：{str(forbidden_texts)}\n"
-            f"2. 包含画面：{str(forbidden_descs)}\n\n"
-            "【输出格式要求】\n"
-            "请严格按照以下两行格式输出，不要包含其他废话：\n"
-            "REASON: [这里简要说明判断理由，不超过20字]\n"
-            "RESULT: [SAFE 或 VIOLATION]\n"
-        )
+        prompt = cfg["prompt"]
 
         try:
-            # [Fix] 优先使用独立配置的 LLM
-            response_text = await self._call_audit_llm(prompt, image_urls)
-            
-            # === 7. 解析结果 ===
-            result_match = re.search(r"RESULT:\s*(VIOLATION|SAFE)", response_text, re.IGNORECASE)
-            reason_match = re.search(r"REASON:\s*(.+)", response_text, re.IGNORECASE)
-            
-            is_violation = False
-            reason_str = "未说明理由"
-
-            if result_match and "VIOLATION" in result_match.group(1).upper():
-                is_violation = True
-            # 兜底检测
-            if not result_match and "VIOLATION" in response_text.upper():
-                is_violation = True
-                
-            if reason_match:
-                reason_str = reason_match.group(1).strip()
-            elif is_violation:
-                reason_str = response_text.split('\n')[0][:50]
+            # 命中判定缓存则跳过 LLM
+            cached = self._get_cached_verdict(prompt, image_urls)
+            if cached:
+                is_violation, reason_str, violation_url = cached
+            else:
+                # === 7. 提交审核并解析结果 (短时间内的多条消息会合并为一次 LLM 调用) ===
+                is_violation, reason_str, violation_url, cacheable = await self._audit_burst(
+                    (group_id, user_id), prompt, image_urls
+                )
+
+                # 多图违规时无法确定是哪一张，只缓存可归因的判定；
+                # 分块审核时可能有分块失败，其安全判定也不缓存
+                if cacheable and (len(image_urls) == 1 or (not is_violation and len(image_urls) <= _MAX_IMAGES)):
+                    for url in image_urls:
+                        self._put_cached_verdict(prompt, url, is_violation, reason_str)
 
             # === 8. 判罚 ===
             if is_violation:
-                logger.info(f"[ImageGuard] 违规命中: {reason_str}")
-                await self.enforce_penalty(event, image_urls[0], is_group, reason_str)
+                logger.info("[ImageGuard] 违规命中: %s", reason_str)
+                await self.enforce_penalty(event, client, violation_url, is_group, reason_str)
                 
         except Exception as e:
-            logger.error(f"[ImageGuard] Check failed: {e}")
+            logger.error("[ImageGuard] Check failed: %s", e)
 
-    async def _call_audit_llm(self, prompt, image_urls):
+    async def _call_audit_llm(self, prompt, image_urls, max_tokens=100):
         """核心修复：支持独立 LLM 配置"""
-        custom_key = self.config.get("llm_api_key")
-        custom_base = self.config.get("llm_base_url")
-        custom_model = self.config.get("llm_model")
+        custom_key = self._cached["llm_api_key"]
+        custom_base = self._cached["llm_base_url"]
+        custom_model = self._cached["llm_model"]
 
         # 1. 独立配置模式 (httpx)
         if custom_key and custom_base:
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt}
-                    ]
-                }
-            ]
-            # 添加图片
-            for url in image_urls:
-                messages[0]["content"].append({
-                    "type": "image_url",
-                    "image_url": {"url": url}
-                })
-
-            async with httpx.AsyncClient(timeout=30) as client:
-                payload = {
-                    "model": custom_model or "gpt-4o",
-                    "messages": messages,
-                    "max_tokens": 100
-                }
-                resp = await client.post(
-                    f"{custom_base.rstrip('/')}/v1/chat/completions",
-                    json=payload,
-                    headers={"Authorization": f"Bearer {custom_key}"}
-                )
-                resp.raise_for_status()
-                return resp.json()["choices"][0]["message"]["content"]
-        
+            import httpx
+
+            content = [{"type": "text", "text": prompt}]
+            content.extend({"type": "image_url", "image_url": {"url": url}} for url in image_urls)
+            messages = [{"role": "user", "content": content}]
+
+            client = self._client()
+            url = f"{custom_base.rstrip('/')}/v1/chat/completions"
+            headers = {
+                "Authorization": f"Bearer {custom_key}",
+                "Content-Type": "application/json"
+            }
+            payload = {
+                "model": custom_model or "gpt-4o",
+                "messages": messages,
+                "max_tokens": max_tokens
+            }
+
+            # 优先流式读取；仅当服务端明确不支持 stream 时回退到普通请求
+            if not self._stream_unsupported:
+                try:
+                    return await self._stream_chat(client, url, headers, payload)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in (400, 404, 415, 422): raise
+                    if "stream" not in e.response.text.lower(): raise
+                    self._stream_unsupported = True
+                    logger.warning("[ImageGuard] Stream rejected (%s), fallback to non-stream", e.response.status_code)
+
+            resp = await client.post(url, content=_dumps(payload), headers=headers)
+            resp.raise_for_status()
+            return _loads(resp.content)["choices"][0]["message"]["content"]
+
         # 2. 回退模式 (AstrBot Provider)
         provider = self.context.get_using_provider()
         if not provider:
@@ -163,52 +501,93 @@ class ImageGuard(Star):
         )
         return resp.completion_text
 
-    async def enforce_penalty(self, event: AstrMessageEvent, violation_img_url: str, is_group: bool, reason: str):
-        """执行判罚 (依赖 OneBot 协议)"""
+    async def _stream_chat(self, client, url, headers, payload):
+        """以 SSE 流式读取回复，收到完整的 RESULT 与 REASON 行后立即断开，返回已收到的全部文本"""
+        body = _dumps({**payload, "stream": True})
+        async with client.stream("POST", url, content=body, headers=headers) as resp:
+            if resp.is_error:
+                # 先读取错误内容，供调用方判断是否为不支持 stream
+                await resp.aread()
+            resp.raise_for_status()
+            # 部分服务端会忽略 stream 参数，直接返回完整 JSON
+            if "text/event-stream" not in resp.headers.get("content-type", ""):
+                data = _loads(await resp.aread())
+                return data["choices"][0]["message"]["content"]
+
+            parts = []
+            pending = ""
+            got_result = got_reason = False
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"): continue
+                data = line[5:].strip()
+                if data == "[DONE]": break
+                chunk = _loads(data)
+                if chunk.get("error"):
+                    raise RuntimeError(f"LLM stream error: {chunk['error']}")
+                choices = chunk.get("choices")
+                if not choices: continue
+                delta = (choices[0].get("delta") or {}).get("content")
+                if not delta: continue
+
+                parts.append(delta)
+                pending += delta
+                while "\n" in pending:
+                    done_line, pending = pending.split("\n", 1)
+                    prefix = done_line.lstrip()[:7].upper()
+                    got_result = got_result or prefix == "RESULT:"
+                    got_reason = got_reason or prefix == "REASON:"
+                # RESULT 与 REASON 行都已完整收到即提前断开（连接随之关闭，不再复用）
+                if got_result and got_reason: break
+
+        text = "".join(parts)
+        if not text.strip():
+            raise ValueError("Empty LLM response")
+        return text
+
+    async def enforce_penalty(self, event: AstrMessageEvent, client, violation_img_url: str, is_group: bool, reason: str):
+        """执行判罚 (依赖 OneBot 协议)，client 由调用方预先解析"""
         user_id = event.get_sender_id()
         group_id = event.get_group_id()
         user_name = event.get_sender_name()
         
         recalled = False
         banned = False
-        duration = int(self.config.get("ban_duration", 86400))
+        duration = self._cached["ban_duration"]
+        call_action = client.api.call_action
 
-        client = None
-        if hasattr(event, "bot"): client = event.bot
-        elif hasattr(event, "client"): client = event.client
+        # A/B. 撤回消息与禁言用户互不依赖，并发执行
+        recall_coro = ban_coro = None
+        if self._cached["enable_recall"] and is_group:
+            msg_id = getattr(event.message_obj, "message_id", None)
+            if msg_id:
+                recall_coro = call_action('delete_msg', message_id=msg_id)
 
-        if not client: return
-        if not hasattr(client, "api") or not hasattr(client.api, "call_action"):
-            return
+        if duration > 0 and is_group:
+            ban_coro = call_action(
+                "set_group_ban",
+                group_id=group_id,
+                user_id=user_id,
+                duration=duration
+            )
 
-        # A. 撤回消息
-        if self.config.get("enable_recall", True) and is_group:
-            try:
-                msg_id = None
-                if hasattr(event.message_obj, "message_id"):
-                    msg_id = event.message_obj.message_id
-                
-                if msg_id:
-                    await client.api.call_action('delete_msg', message_id=msg_id)
+        coros = [c for c in (recall_coro, ban_coro) if c is not None]
+        if coros:
+            results = iter(await asyncio.gather(*coros, return_exceptions=True))
+            if recall_coro is not None:
+                res = next(results)
+                if isinstance(res, BaseException):
+                    logger.warning("[ImageGuard] Silent Recall failed: %s", res)
+                else:
                     recalled = True
-            except Exception as e:
-                logger.warning(f"[ImageGuard] Silent Recall failed: {e}")
-
-        # B. 禁言用户
-        if duration > 0 and is_group:
-            try:
-                await client.api.call_action(
-                    "set_group_ban",
-                    group_id=group_id,
-                    user_id=user_id,
-                    duration=duration
-                )
-                banned = True
-            except Exception as e:
-                logger.warning(f"[ImageGuard] Silent Ban failed: {e}")
+            if ban_coro is not None:
+                res = next(results)
+                if isinstance(res, BaseException):
+                    logger.warning("[ImageGuard] Silent Ban failed: %s", res)
+                else:
+                    banned = True
 
         # C. 上报证据 (私聊)
-        report_target = self.config.get("report_target_id")
+        report_target = self._cached["report_target_id"]
         if report_target:
             try:
                 target_id = int(str(report_target).strip())
@@ -229,11 +608,11 @@ class ImageGuard(Star):
                     {"type": "image", "data": {"file": violation_img_url}}
                 ]
 
-                await client.api.call_action(
+                await call_action(
                     "send_private_msg",
                     user_id=target_id,
                     message=message_payload
                 )
 
             except Exception as e:
-                logger.error(f"[ImageGuard] Report failed: {e}")
+                logger.error("[ImageGuard] Report failed: %s", e)